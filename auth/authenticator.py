@@ -11,6 +11,8 @@ import jwt
 
 from tornado import web
 from tornado.httpclient import AsyncHTTPClient
+from tornado.httpclient import HTTPClientError
+from tornado.log import app_log
 
 from traitlets import Unicode
 from traitlets import Bool
@@ -19,10 +21,12 @@ from oauthenticator.oauth2 import OAuthenticator
 
 from .handler import LTI13LoginHandler
 from .handler import LTI13CallbackHandler
+from .illumidesk import register_assignment
 from .illumidesk import setup_course
+from .jupyterhub_api import get_hub_state
 from .lms import email_to_username
 from .lms import fetch_students_from_lms
-from .lms import get_lms_access_token
+from .lms import get_cached_lms_access_token
 
 
 logger = logging.getLogger(__name__)
@@ -77,6 +81,15 @@ class LTI13Authenticator(OAuthenticator):
     authorize_url = Unicode(config=True)
     token_url = Unicode(config=True)
     setup_courses = Bool(config=True, default=False)
+    illumidesk_url = Unicode(
+        config=True,
+        help='Base URL of the IllumiDesk service assignments are registered with. Registration is off when unset.',
+    )
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if 'JUPYTERHUB_API_TOKEN' in os.environ:
+            get_hub_state().start()
 
     async def authenticate(self, handler, data=None):
         url = f'https://{handler.request.host}'
@@ -101,6 +114,8 @@ class LTI13Authenticator(OAuthenticator):
         if self.setup_courses:
             response = await setup_course(org, self.course_id, handler.request.host, int(lms_course_id))
         await fetch_students_from_lms(org, self.decoded, url, self.token_url)
+        if self.illumidesk_url:
+            register_assignment(decoded, self.illumidesk_url)
         user_type = 'Instructor'
         if 'http://purl.imsglobal.org/vocab/lis/v2/membership#Learner' in decoded['https://purl.imsglobal.org/spec/lti/claim/roles']:
             user_type = 'Learner'
@@ -110,12 +125,11 @@ class LTI13Authenticator(OAuthenticator):
             'is_new_setup': response['is_new_setup'],
             'user_type': user_type,
             'lms_instance': self.endpoint,
-            'token': await get_lms_access_token(
-                url,
-                self.token_url,
-                os.environ['PRIVATE_KEY'],
-                decoded['aud'],
-            )
+            'lms_token_params': {
+                'iss': url,
+                'token_endpoint': self.token_url,
+                'client_id': decoded['aud'],
+            },
         }}
 
     async def pre_spawn_start(self, user, spawner):
@@ -129,5 +143,25 @@ class LTI13Authenticator(OAuthenticator):
         logger.debug('LMS instance from auth_state: %s' % auth_state['lms_instance'])
         spawner.environment['USER_ROLE'] = auth_state['user_type']
         logger.debug('User role from auth_state: %s' % auth_state['user_type'])
-        spawner.environment['TOKEN'] = json.dumps(auth_state['token'])
-        logger.debug('Token from auth_state: %s' % auth_state['token'])
+        token_params = auth_state.get('lms_token_params')
+        if token_params is None:
+            # auth_state stored before tokens were obtained lazily
+            token = auth_state.get('token')
+            logger.debug('No lms_token_params in auth_state, using stored token %s' % token)
+        else:
+            # the spawned server keeps this token, so hand it at least half of its lifetime
+            try:
+                token = await get_cached_lms_access_token(
+                    token_params['iss'],
+                    token_params['token_endpoint'],
+                    os.environ['PRIVATE_KEY'],
+                    token_params['client_id'],
+                    min_lifetime=0.5,
+                )
+            except (HTTPClientError, OSError):
+                # the server runs without TOKEN, grades obtain their own token when sent
+                app_log.exception('Error obtaining lms access token, spawning without TOKEN')
+                token = None
+            logger.debug('Token obtained at spawn time: %s' % token)
+        if token is not None:
+            spawner.environment['TOKEN'] = json.dumps(token)
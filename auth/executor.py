@@ -0,0 +1,103 @@
+import os
+import logging
+import threading
+import time
+
+from asyncio import wrap_future
+from concurrent.futures import ThreadPoolExecutor
+
+from tornado.ioloop import PeriodicCallback
+from tornado.log import app_log
+
+
+logger = logging.getLogger(__name__)
+
+
+class BlockingExecutor:
+    """
+    Bounded thread pool for filesystem, sqlite and crypto work that would
+    otherwise block the IOLoop. Tracks queue depth and time spent waiting,
+    and logs them every `stats_interval` seconds while work is queued.
+    """
+    def __init__(self, max_workers=4, stats_interval=60):
+        self.max_workers = max_workers
+        self.stats_interval = stats_interval
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='lti13-blocking')
+        self.queued = 0
+        self.running = 0
+        self._lock = threading.Lock()
+        self.last_wait = 0.0
+        self.max_wait = 0.0
+        self._stats_callback = None
+        logger.debug('Instantiating BlockingExecutor with %d workers' % max_workers)
+
+    @property
+    def queue_depth(self):
+        with self._lock:
+            return self.queued
+
+    def stats(self):
+        with self._lock:
+            return {
+                'max_workers': self.max_workers,
+                'running': self.running,
+                'queue_depth': self.queued,
+                'last_wait': self.last_wait,
+                'max_wait': self.max_wait,
+            }
+
+    def log_stats(self):
+        stats = self.stats()
+        if stats['queue_depth']:
+            app_log.info('Blocking executor is backed up: %s' % stats)
+
+    def _start_stats_log(self):
+        if self._stats_callback is None:
+            self._stats_callback = PeriodicCallback(self.log_stats, self.stats_interval * 1000)
+            self._stats_callback.start()
+
+    def _on_done(self, future):
+        # a job cancelled while queued never reaches call()
+        if future.cancelled():
+            with self._lock:
+                self.queued -= 1
+
+    async def run(self, fn, *args, **kwargs):
+        self._start_stats_log()
+        submitted = time.monotonic()
+
+        def call():
+            wait = time.monotonic() - submitted
+            with self._lock:
+                self.queued -= 1
+                self.running += 1
+                self.last_wait = wait
+                self.max_wait = max(self.max_wait, wait)
+                queue_depth = self.queued
+            logger.debug('Running %s after waiting %.3fs, queue depth %d' % (
+                getattr(fn, '__name__', fn), wait, queue_depth))
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self.running -= 1
+
+        with self._lock:
+            self.queued += 1
+        future = self.executor.submit(call)
+        future.add_done_callback(self._on_done)
+        return await wrap_future(future)
+
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = BlockingExecutor(int(os.environ.get('BLOCKING_IO_WORKERS', 4)))
+    return _executor
+
+
+async def run_blocking(fn, *args, **kwargs):
+    return await get_executor().run(fn, *args, **kwargs)
@@ -9,7 +9,7 @@ from importlib import import_module
 from tornado.httpclient import AsyncHTTPClient
 from tornado.log import app_log
 
-from .lms import get_lms_access_token
+from .lms import get_cached_lms_access_token
 
 
 logger = logging.getLogger(__name__)
@@ -67,7 +67,7 @@ async def send(assignment_name, token, grade, user_id, lineitems, lms):
 class CanvasSender(GradesSender):
 
     async def send(self):
-        token = await get_lms_access_token(
+        token = await get_cached_lms_access_token(
             self.url,
             os.environ['LMS_TOKEN_ENDPOINT'],
             os.environ['PRIVATE_KEY'],
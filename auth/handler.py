@@ -24,6 +24,7 @@ from oauthenticator.oauth2 import guess_callback_uri
 from tornado import web
 from tornado.auth import OAuth2Mixin
 
+from .executor import run_blocking
 from .grades import get_sender
 
 
@@ -97,7 +98,10 @@ class LTI13CallbackHandler(OAuthCallbackHandler):
 class JWKS(BaseHandler):
     async def get(self):
         self.set_header('Content-Type', 'application/json')
-        private_key = os.environ['PRIVATE_KEY']
+        keys = await run_blocking(self._get_keys, os.environ['PRIVATE_KEY'])
+        self.write(json.dumps(keys))
+
+    def _get_keys(self, private_key):
         kid = md5(private_key.encode('utf-8')).hexdigest()
         logger.debug('kid is %s' % kid)
         public_key = RSA.importKey(private_key).publickey()
@@ -110,7 +114,7 @@ class JWKS(BaseHandler):
             'n': long_to_base64(public_key.n),
             'e': long_to_base64(public_key.e),
         }]}
-        self.write(json.dumps(keys))
+        return keys
 
 
 class FileSelectHandler(BaseHandler):
@@ -123,7 +127,7 @@ class FileSelectHandler(BaseHandler):
             self.authenticator.course_id
         )
         files = []
-        for f in self._iterate_dir(path):
+        for f in await run_blocking(lambda: list(self._iterate_dir(path))):
             fpath = str(f.relative_to(path))
             logger.debug('Getting files fpath %s' % fpath)
             url = f'https://{self.request.host}/jupyterhub/user/{user.name}/notebooks/{fpath}'
@@ -2,13 +2,17 @@ import json
 import logging
 import urllib
 
+from asyncio import gather
+
 from tornado.httpclient import AsyncHTTPClient
+from tornado.ioloop import IOLoop
+from tornado.log import app_log
 
 
 logger = logging.getLogger(__name__)
 
 
-async def send_assignment_to_illumidesk(decoded, url):
+def get_assignment_data(decoded):
     if decoded['https://purl.imsglobal.org/spec/lti/claim/message_type'] != 'LtiResourceLinkRequest':
         return
     if 'https://purl.imsglobal.org/spec/lti-ags/claim/endpoint' not in decoded:
@@ -18,8 +22,6 @@ async def send_assignment_to_illumidesk(decoded, url):
     *_, path = target_link_uri.split('/', 9)
     if not path:
         return
-    endpoint = f'{url}/assignments/create/'
-    logger.debug('endpoint is %s' % endpoint)
     context = decoded['https://purl.imsglobal.org/spec/lti/claim/context']
     logger.debug('context is %s' % context)
     resource_link = decoded['https://purl.imsglobal.org/spec/lti/claim/resource_link']
@@ -28,9 +30,9 @@ async def send_assignment_to_illumidesk(decoded, url):
     data = {
         'email': decoded['email'],
         'user_id': decoded['sub'],
-        'name': resource_link['title'],
-        'description': resource_link['description'],
-        'course': context['title'],
+        'name': resource_link.get('title', ''),
+        'description': resource_link.get('description', ''),
+        'course': context.get('title', ''),
         'path': path,
         'lms_assignment_id': resource_link['id'],
         'lms_config': json.dumps({
@@ -39,11 +41,84 @@ async def send_assignment_to_illumidesk(decoded, url):
         })
     }
     logger.debug('Data to send assignments %s' % data)
+    return data
+
+
+async def post_assignment(data, url):
+    endpoint = f'{url}/assignments/create/'
+    logger.debug('endpoint is %s' % endpoint)
     body = urllib.parse.urlencode(data)
     client = AsyncHTTPClient()
     await client.fetch(endpoint, method='POST', headers=None, body=body)
 
 
+async def send_assignment_to_illumidesk(decoded, url):
+    data = get_assignment_data(decoded)
+    if data is None:
+        return
+    await post_assignment(data, url)
+
+
+class AssignmentRegistrar:
+    """
+    Registers each (resource link, course) assignment once. New registrations
+    are collected for `batch_window` seconds and then posted from the IOLoop
+    concurrently, one form-encoded request per assignment.
+    """
+    def __init__(self, url, batch_window=2.0):
+        self.url = url
+        self.batch_window = batch_window
+        self.registered = set()
+        self.pending = {}
+        self._flush_handle = None
+        logger.debug('Instantiating AssignmentRegistrar with url %s' % url)
+
+    def register(self, decoded):
+        data = get_assignment_data(decoded)
+        if data is None:
+            return
+        context = decoded['https://purl.imsglobal.org/spec/lti/claim/context']
+        key = (data['lms_assignment_id'], context['id'])
+        if key in self.registered or key in self.pending:
+            logger.debug('Assignment %s already registered, skipping' % (key,))
+            return
+        logger.debug('Queueing assignment %s for registration' % (key,))
+        self.pending[key] = data
+        if self._flush_handle is None:
+            self._flush_handle = IOLoop.current().call_later(self.batch_window, self.flush)
+
+    async def flush(self):
+        self._flush_handle = None
+        batch, self.pending = self.pending, {}
+        if not batch:
+            return
+        logger.debug('Registering %d assignments with %s' % (len(batch), self.url))
+        # /assignments/create/ takes one form-encoded record per request
+        results = await gather(
+            *[post_assignment(data, self.url) for data in batch.values()],
+            return_exceptions=True,
+        )
+        for key, result in zip(batch, results):
+            if isinstance(result, Exception):
+                # left unregistered so that a later launch queues it again
+                app_log.error('Error registering assignment %s with IllumiDesk: %s' % (key, result))
+                continue
+            self.registered.add(key)
+
+
+_registrars = {}
+
+
+def register_assignment(decoded, url):
+    # bookkeeping only, so it must never fail the launch
+    try:
+        if url not in _registrars:
+            _registrars[url] = AssignmentRegistrar(url)
+        _registrars[url].register(decoded)
+    except Exception:
+        app_log.exception('Error queueing assignment registration with IllumiDesk')
+
+
 async def setup_course(org, name, domain, lms_course_id):
     client = AsyncHTTPClient()
     data = {
@@ -1,13 +1,25 @@
 import os
 import json
 import logging
+import time
 
 from tornado.httpclient import AsyncHTTPClient
+from tornado.httpclient import HTTPClientError
+from tornado.ioloop import IOLoop
+from tornado.ioloop import PeriodicCallback
+from tornado.locks import Lock
+from tornado.log import app_log
 
 
 logger = logging.getLogger(__name__)
 
 
+# JupyterHub >= 2 pages user and group listings when asked for this media type
+PAGINATION_HEADERS = {
+    'Accept': 'application/jupyterhub-pagination+json',
+}
+
+
 class JupyterHubAPI:
     def __init__(self, token, url='http://chp:8000/hub/api'):
         self.client = AsyncHTTPClient()
@@ -31,10 +43,18 @@ class JupyterHubAPI:
         logger.debug('Creating group with group name %s' % group_name)
         return await self._request(f'groups/{group_name}', body='', method='POST')
 
+    async def get_groups(self, offset=0, limit=200):
+        logger.debug('Getting groups from offset %s' % offset)
+        return await self._request(f'groups?offset={offset}&limit={limit}', headers=dict(PAGINATION_HEADERS))
+
     async def get_group(self, group_name):
         logger.debug('Getting group with group name %s' % group_name)
         return await self._request(f'groups/{group_name}')
 
+    async def get_users(self, offset=0, limit=200):
+        logger.debug('Getting users from offset %s' % offset)
+        return await self._request(f'users?offset={offset}&limit={limit}', headers=dict(PAGINATION_HEADERS))
+
     async def create_users(self, *users):
         logger.debug('Creating users %s' % users)
         return await self._request('users', body=json.dumps({'usernames': users}), method='POST')
@@ -46,3 +66,173 @@ class JupyterHubAPI:
     async def add_group_members(self, group, *members):
         logger.debug('Adding group members %s' % members)
         return await self._request(f'groups/{group}/users', body=json.dumps({'users': members}), method='POST')
+
+
+class HubState:
+    """
+    Local mirror of the hub's users and group memberships.
+
+    Filled by one listing of users and groups when started, updated by our own
+    writes and reconciled with the hub every `reconcile_interval` seconds, so
+    that only missing users and memberships are sent to the hub API. Until a
+    listing succeeds, memberships are looked up per group as before and the
+    listing is retried with a backoff of up to `max_retry_backoff` seconds.
+    """
+    def __init__(self, api, reconcile_interval=300, page_size=200, max_retry_backoff=60):
+        self.api = api
+        self.reconcile_interval = reconcile_interval
+        self.page_size = page_size
+        self.max_retry_backoff = max_retry_backoff
+        self.users = set()
+        self.groups = {}
+        self._synced = False
+        self._retry_at = 0
+        self._retry_backoff = 1
+        self._lock = Lock()
+        self._reconcile_callback = None
+
+    def start(self):
+        if self._reconcile_callback is not None:
+            return
+        self._reconcile_callback = PeriodicCallback(self.reconcile, self.reconcile_interval * 1000)
+        self._reconcile_callback.start()
+        IOLoop.current().add_callback(self._warm)
+
+    async def _warm(self):
+        # the hub API may not be listening yet when the authenticator is created
+        if not await self.ensure_synced():
+            IOLoop.current().call_later(self._retry_backoff, self._warm)
+
+    async def _list_all(self, get_page):
+        items = []
+        offset = 0
+        while True:
+            resp = await get_page(offset=offset, limit=self.page_size)
+            page = json.loads(resp.body)
+            if isinstance(page, list):
+                # JupyterHub < 2 ignores the pagination request and lists everything
+                return page
+            items.extend(page['items'])
+            next_page = page['_pagination'].get('next')
+            if not next_page:
+                return items
+            offset = next_page['offset']
+
+    async def sync(self):
+        users = {user['name'] for user in await self._list_all(self.api.get_users)}
+        groups = {group['name']: set(group['users']) for group in await self._list_all(self.api.get_groups)}
+        self.users = users
+        self.groups = groups
+        self._synced = True
+        logger.debug('Synced hub state with %d users and %d groups' % (len(users), len(groups)))
+
+    async def reconcile(self):
+        try:
+            await self.sync()
+        except Exception:
+            app_log.exception('Error reconciling hub state')
+
+    async def ensure_synced(self):
+        async with self._lock:
+            if not self._synced and time.monotonic() >= self._retry_at:
+                await self.reconcile()
+                if not self._synced:
+                    self._retry_at = time.monotonic() + self._retry_backoff
+                    self._retry_backoff = min(self._retry_backoff * 2, self.max_retry_backoff)
+        return self._synced
+
+    async def ensure_group(self, group):
+        await self.ensure_synced()
+        if group in self.groups:
+            return
+        try:
+            logger.debug('Creating group %s' % group)
+            await self.api.create_group(group)
+        except HTTPClientError as e:
+            if e.code != 409:
+                app_log.exception('Error during group creation')
+                return
+        self.groups.setdefault(group, set())
+
+    async def ensure_users(self, *usernames):
+        """
+        Creates the users missing from the hub and returns the usernames known to exist.
+        """
+        await self.ensure_synced()
+        usernames = list(dict.fromkeys(usernames))
+        missing = [username for username in usernames if username not in self.users]
+        if missing:
+            try:
+                logger.debug('Adding users %s to JupyterHub' % missing)
+                await self.api.create_users(*missing)
+                self.users.update(missing)
+            except HTTPClientError as e:
+                if e.code == 409:
+                    self.users.update(missing)
+                else:
+                    # one invalid username fails the whole request, so retry them one by one
+                    app_log.warning('Error adding users to jupyterhub, retrying one by one: %s' % e)
+                    await self._create_users_one_by_one(missing)
+        return [username for username in usernames if username in self.users]
+
+    async def _create_users_one_by_one(self, usernames):
+        for username in usernames:
+            try:
+                logger.debug('Adding user %s to JupyterHub' % username)
+                await self.api.create_user(username)
+            except HTTPClientError as e:
+                if e.code != 409:
+                    app_log.exception('Error adding user %s to jupyterhub' % username)
+                    continue
+            self.users.add(username)
+
+    async def ensure_group_members(self, group, *usernames):
+        synced = await self.ensure_synced()
+        if not synced:
+            try:
+                resp = await self.api.get_group(group)
+            except HTTPClientError:
+                app_log.exception('Error fetching group %s' % group)
+                return
+            self.groups[group] = set(json.loads(resp.body)['users'])
+        members = self.groups.get(group, set())
+        missing = [username for username in dict.fromkeys(usernames) if username not in members]
+        if not missing:
+            return
+        try:
+            logger.debug('Adding users %s to group %s' % (missing, group))
+            await self.api.add_group_members(group, *missing)
+        except HTTPClientError as e:
+            if e.code != 409:
+                # a user deleted on the hub fails the whole request, so retry them one by one
+                app_log.warning('Error adding users to group %s, retrying one by one: %s' % (group, e))
+                await self._add_group_members_one_by_one(group, missing)
+                return
+        # reconcile may have replaced self.groups while the request was in flight
+        self.groups.setdefault(group, set()).update(missing)
+
+    async def _add_group_members_one_by_one(self, group, usernames):
+        stale = False
+        for username in usernames:
+            try:
+                await self.api.add_group_members(group, username)
+            except HTTPClientError as e:
+                if e.code != 409:
+                    app_log.exception('Error adding user %s to group %s' % (username, group))
+                    # most likely gone from the hub, forget it until the next reconcile says otherwise
+                    self.users.discard(username)
+                    stale = True
+                    continue
+            self.groups.setdefault(group, set()).add(username)
+        if stale:
+            IOLoop.current().add_callback(self.reconcile)
+
+
+_hub_state = None
+
+
+def get_hub_state():
+    global _hub_state
+    if _hub_state is None:
+        _hub_state = HubState(JupyterHubAPI(os.environ['JUPYTERHUB_API_TOKEN']))
+    return _hub_state
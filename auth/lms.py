@@ -10,6 +10,7 @@ import uuid
 
 from pathlib import Path
 
+from tornado.locks import Lock
 from tornado.log import app_log
 from tornado.httpclient import HTTPClientError
 from tornado.httpclient import AsyncHTTPClient
@@ -17,12 +18,21 @@ from tornado.httpclient import AsyncHTTPClient
 from nbgrader.api import Gradebook
 from nbgrader.api import InvalidEntry
 
-from .jupyterhub_api import JupyterHubAPI
+from .executor import run_blocking
+from .jupyterhub_api import get_hub_state
 
 
 logger = logging.getLogger(__name__)
 
 
+# access tokens obtained from the LMS, keyed by the parameters used to mint them
+_access_tokens = {}
+_access_token_locks = {}
+
+# serializes gradebook syncs per course
+_gradebook_locks = {}
+
+
 def email_to_username(email):
     if not email:
         raise ValueError("Email is empty")
@@ -73,6 +83,33 @@ async def get_lms_access_token(iss, token_endpoint, private_key, client_id, scop
     return json.loads(resp.body)
 
 
+async def get_cached_lms_access_token(iss, token_endpoint, private_key, client_id, scope=None,
+                                      leeway=60, min_lifetime=0.0):
+    """
+    Returns an LMS access token, reusing a previously obtained one while more than
+    `leeway` seconds and `min_lifetime` (a fraction of its lifetime) remain.
+    """
+    key = (iss, token_endpoint, client_id, scope)
+    if key not in _access_token_locks:
+        _access_token_locks[key] = Lock()
+    async with _access_token_locks[key]:
+        cached = _access_tokens.get(key)
+        if cached is not None:
+            remaining = cached['expires_at'] - time.time()
+            if remaining > max(leeway, cached['expires_in'] * min_lifetime):
+                logger.debug('Reusing cached lms access token for %s' % client_id)
+                return cached['token']
+        logger.debug('Cached lms access token for %s is missing or expired' % client_id)
+        token = await get_lms_access_token(iss, token_endpoint, private_key, client_id, scope=scope)
+        expires_in = int(token.get('expires_in', 3600))
+        _access_tokens[key] = {
+            'token': token,
+            'expires_in': expires_in,
+            'expires_at': time.time() + expires_in,
+        }
+        return token
+
+
 async def fetch_students_from_lms(org, decoded, iss, lms_token_endpoint):
     token = await get_lms_access_token(
         iss,
@@ -115,6 +152,14 @@ def is_teacher(member):
 
 
 async def add_students_to_gradebook(org, course_id, students):
+    # logins for the same course would otherwise write the same sqlite file from several threads
+    if course_id not in _gradebook_locks:
+        _gradebook_locks[course_id] = Lock()
+    async with _gradebook_locks[course_id]:
+        await run_blocking(_add_students_to_gradebook, org, course_id, students)
+
+
+def _add_students_to_gradebook(org, course_id, students):
     username = f'grader-{course_id.lower()}'
     logger.debug('Adding students to gradebook %s' % username)
     db_url = Path('/home', username, course_id, 'gradebook.db')
@@ -134,51 +179,21 @@ async def add_students_to_gradebook(org, course_id, students):
 
 
 async def add_students_to_jupyterhub(course_id, students):
-    jupyterhub_api = JupyterHubAPI(os.environ['JUPYTERHUB_API_TOKEN'])
     students_group = f'nbgrader-{course_id}'
     logger.debug('Students group name %s' % students_group)
-    try:
-        logger.debug('Creating student group %s' % students_group)
-        await jupyterhub_api.create_group(students_group)
-    except HTTPClientError as e:
-        if e.code != 409:
-            app_log.exception("Error during teachers group creation")
     await add_users_to_jupyterhub(course_id, students, students_group)
 
 
 async def add_teachers_to_jupyterhub(course_id, teachers):
-    jupyterhub_api = JupyterHubAPI(os.environ['JUPYTERHUB_API_TOKEN'])
     teachers_group = f'formgrade-{course_id}'
     logger.debug('Instrutors group name %s' % teachers_group)
-    try:
-        logger.debug('Creating instructor group %s' % teachers_group)
-        await jupyterhub_api.create_group(teachers_group)
-    except HTTPClientError as e:
-        if e.code != 409:
-            app_log.exception("Error during teachers group creation")
     await add_users_to_jupyterhub(course_id, teachers, teachers_group)
 
 
 async def add_users_to_jupyterhub(course_id, users, group):
-    jupyterhub_api = JupyterHubAPI(os.environ['JUPYTERHUB_API_TOKEN'])
-    usernames = []
-    for student in users:
-        username = email_to_username(student['email'])
-        usernames.append(username)
-        try:
-            logger.debug('Adding user %s to JupyterHub' % username)
-            await jupyterhub_api.create_user(username)
-        except HTTPClientError as e:
-            if e.code == 409:
-                continue
-            app_log.exception("Error adding user to jupyterhub")
-    resp = await jupyterhub_api.get_group(group)
-    group_users = json.loads(resp.body)["users"]
-    logger.debug('Fetching group with users %s' % json.loads(resp.body)["users"])
-    new_users = [user for user in usernames if user not in group_users]
-    try:
-        logger.debug('Adding user list to JupyterHub')
-        await jupyterhub_api.add_group_members(group, *new_users)
-    except HTTPClientError as e:
-        if e.code != 409:
-            app_log.exception("Error during teachers group creation")
+    hub_state = get_hub_state()
+    usernames = [email_to_username(user['email']) for user in users]
+    logger.debug('Syncing users %s with JupyterHub group %s' % (usernames, group))
+    await hub_state.ensure_group(group)
+    existing = await hub_state.ensure_users(*usernames)
+    await hub_state.ensure_group_members(group, *existing)
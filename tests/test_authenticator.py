@@ -0,0 +1,62 @@
+import asyncio
+
+from types import SimpleNamespace
+
+import pytest
+
+from tornado.httpclient import HTTPClientError
+
+from auth import authenticator
+from auth.authenticator import LTI13Authenticator
+
+
+class FakeUser:
+    def __init__(self, auth_state):
+        self.auth_state = auth_state
+
+    async def get_auth_state(self):
+        return self.auth_state
+
+
+def auth_state(**kwargs):
+    state = {
+        'course_id': 'course',
+        'user_type': 'Learner',
+        'lms_instance': 'https://lms',
+        'lms_token_params': {'iss': 'https://hub', 'token_endpoint': 'https://lms/token', 'client_id': 'client'},
+    }
+    state.update(kwargs)
+    return state
+
+
+@pytest.fixture
+def spawner(monkeypatch):
+    monkeypatch.setenv('PRIVATE_KEY', 'key')
+    monkeypatch.delenv('JUPYTERHUB_API_TOKEN', raising=False)
+    return SimpleNamespace(environment={})
+
+
+def test_spawn_gets_token(spawner, monkeypatch):
+    async def fake_get_token(*args, **kwargs):
+        return {'access_token': 'abc', 'token_type': 'Bearer'}
+
+    monkeypatch.setattr(authenticator, 'get_cached_lms_access_token', fake_get_token)
+    asyncio.run(LTI13Authenticator().pre_spawn_start(FakeUser(auth_state()), spawner))
+    assert '"access_token": "abc"' in spawner.environment['TOKEN']
+
+
+def test_spawn_without_token_when_lms_is_down(spawner, monkeypatch):
+    async def fake_get_token(*args, **kwargs):
+        raise HTTPClientError(503)
+
+    monkeypatch.setattr(authenticator, 'get_cached_lms_access_token', fake_get_token)
+    asyncio.run(LTI13Authenticator().pre_spawn_start(FakeUser(auth_state()), spawner))
+    assert 'TOKEN' not in spawner.environment
+    assert spawner.environment['USER_ROLE'] == 'Learner'
+
+
+def test_spawn_with_auth_state_from_before_lazy_tokens(spawner):
+    state = auth_state(token={'access_token': 'old', 'token_type': 'Bearer'})
+    del state['lms_token_params']
+    asyncio.run(LTI13Authenticator().pre_spawn_start(FakeUser(state), spawner))
+    assert '"access_token": "old"' in spawner.environment['TOKEN']
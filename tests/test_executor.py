@@ -0,0 +1,129 @@
+import asyncio
+import threading
+
+import pytest
+
+from auth import executor
+from auth import lms
+
+
+class HeldGradebook:
+    """
+    Stands in for the gradebook sync and holds the worker thread until released.
+    """
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.syncs = []
+
+    def __call__(self, org, course_id, students):
+        self.syncs.append(('start', course_id))
+        self.started.set()
+        assert self.release.wait(timeout=10)
+        self.syncs.append(('end', course_id))
+
+
+@pytest.fixture
+def gradebook(monkeypatch):
+    held = HeldGradebook()
+    monkeypatch.setattr(lms, '_add_students_to_gradebook', held)
+    monkeypatch.setattr(lms, '_gradebook_locks', {})
+    monkeypatch.setattr(executor, '_executor', executor.BlockingExecutor(max_workers=1))
+    yield held
+    held.release.set()
+
+
+def students(count):
+    return [{'email': f'student{i}@example.com', 'user_id': str(i)} for i in range(count)]
+
+
+async def wait_for(event):
+    while not event.is_set():
+        await asyncio.sleep(0.001)
+
+
+async def wait_until(condition):
+    while not condition():
+        await asyncio.sleep(0.001)
+
+
+def test_event_loop_stays_responsive_during_gradebook_sync(gradebook):
+    pool = executor.get_executor()
+
+    async def run():
+        first = asyncio.ensure_future(lms.add_students_to_gradebook('org', 'course-1', students(5000)))
+        second = asyncio.ensure_future(lms.add_students_to_gradebook('org', 'course-2', students(5000)))
+        await asyncio.wait_for(wait_for(gradebook.started), 10)
+        await asyncio.wait_for(wait_until(lambda: pool.queue_depth == 1), 10)
+        # the worker is held, yet the loop keeps running other callbacks
+        ticks = 0
+        for _ in range(100):
+            await asyncio.sleep(0)
+            ticks += 1
+        assert ticks == 100
+        assert pool.stats()['running'] == 1
+        assert pool.queue_depth == 1
+        gradebook.release.set()
+        await asyncio.wait_for(asyncio.gather(first, second), 10)
+
+    asyncio.run(run())
+    stats = pool.stats()
+    assert stats['queue_depth'] == 0
+    assert stats['running'] == 0
+    # the second course waited for the first one to be released
+    assert stats['last_wait'] > 0
+    assert stats['max_wait'] >= stats['last_wait']
+
+
+def test_cancelled_queued_job_leaves_queue_depth_consistent(gradebook):
+    pool = executor.get_executor()
+
+    async def run():
+        first = asyncio.ensure_future(lms.add_students_to_gradebook('org', 'course-1', students(10)))
+        second = asyncio.ensure_future(lms.add_students_to_gradebook('org', 'course-2', students(10)))
+        await asyncio.wait_for(wait_for(gradebook.started), 10)
+        await asyncio.wait_for(wait_until(lambda: pool.queue_depth == 1), 10)
+        second.cancel()
+        await asyncio.gather(second, return_exceptions=True)
+        assert pool.queue_depth == 0
+        gradebook.release.set()
+        await asyncio.wait_for(first, 10)
+
+    asyncio.run(run())
+    assert pool.stats()['queue_depth'] == 0
+    assert gradebook.syncs == [('start', 'course-1'), ('end', 'course-1')]
+
+
+def test_gradebook_syncs_for_one_course_do_not_overlap(gradebook, monkeypatch):
+    monkeypatch.setattr(executor, '_executor', executor.BlockingExecutor(max_workers=2))
+    pool = executor.get_executor()
+
+    async def run():
+        first = asyncio.ensure_future(lms.add_students_to_gradebook('org', 'course-1', students(10)))
+        second = asyncio.ensure_future(lms.add_students_to_gradebook('org', 'course-1', students(10)))
+        await asyncio.wait_for(wait_for(gradebook.started), 10)
+        for _ in range(100):
+            await asyncio.sleep(0)
+        # a worker is free, but the second sync waits on the course lock
+        assert pool.stats()['running'] == 1
+        assert pool.queue_depth == 0
+        gradebook.release.set()
+        await asyncio.wait_for(asyncio.gather(first, second), 10)
+
+    asyncio.run(run())
+    assert gradebook.syncs == [
+        ('start', 'course-1'),
+        ('end', 'course-1'),
+        ('start', 'course-1'),
+        ('end', 'course-1'),
+    ]
+
+
+def test_stats_are_logged_while_work_is_queued(caplog):
+    pool = executor.BlockingExecutor(max_workers=1)
+    with caplog.at_level('INFO', logger='tornado.application'):
+        pool.log_stats()
+        assert caplog.records == []
+        pool.queued = 2
+        pool.log_stats()
+    assert 'queue_depth' in caplog.records[0].getMessage()
@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+
+from auth import illumidesk
+
+
+def make_launch(resource_link_id='link-1', context_id='course-1', email='student@example.com'):
+    return {
+        'https://purl.imsglobal.org/spec/lti/claim/message_type': 'LtiResourceLinkRequest',
+        'https://purl.imsglobal.org/spec/lti-ags/claim/endpoint': {'lineitems': 'https://lms/courses/1/line_items'},
+        'https://purl.imsglobal.org/spec/lti/claim/target_link_uri': 'https://hub/jupyterhub/user/a/b/c/d/e/notebook.ipynb',
+        'https://purl.imsglobal.org/spec/lti/claim/context': {'id': context_id, 'title': 'Course'},
+        'https://purl.imsglobal.org/spec/lti/claim/resource_link': {
+            'id': resource_link_id,
+            'title': 'Assignment',
+            'description': '',
+        },
+        'email': email,
+        'sub': 'user-1',
+        'aud': 'client',
+    }
+
+
+@pytest.fixture
+def posted(monkeypatch):
+    posts = []
+
+    async def fake_post_assignment(data, url):
+        if data['lms_assignment_id'] == 'broken':
+            raise OSError('connection refused')
+        posts.append((url, data))
+
+    monkeypatch.setattr(illumidesk, 'post_assignment', fake_post_assignment)
+    return posts
+
+
+def test_repeat_launches_register_once(posted):
+    registrar = illumidesk.AssignmentRegistrar('https://illumidesk', batch_window=0.05)
+
+    async def run():
+        for i in range(10):
+            registrar.register(make_launch(email=f'student{i}@example.com'))
+        await asyncio.sleep(0.1)
+        registrar.register(make_launch())
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert len(posted) == 1
+    assert posted[0][0] == 'https://illumidesk'
+    assert posted[0][1]['lms_assignment_id'] == 'link-1'
+
+
+def test_new_registrations_are_flushed_together(posted):
+    registrar = illumidesk.AssignmentRegistrar('https://illumidesk', batch_window=0.05)
+
+    async def run():
+        registrar.register(make_launch('link-1'))
+        registrar.register(make_launch('link-2'))
+        registrar.register(make_launch('link-1', context_id='course-2'))
+        assert posted == []
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert len(posted) == 3
+    assert len(registrar.registered) == 3
+
+
+def test_failed_registration_is_retried(posted):
+    registrar = illumidesk.AssignmentRegistrar('https://illumidesk', batch_window=0.05)
+
+    async def run():
+        registrar.register(make_launch('broken'))
+        registrar.register(make_launch('link-1'))
+        await asyncio.sleep(0.1)
+        assert registrar.registered == {('link-1', 'course-1')}
+        registrar.register(make_launch('broken'))
+        assert ('broken', 'course-1') in registrar.pending
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+
+
+def test_other_launches_are_ignored(posted):
+    registrar = illumidesk.AssignmentRegistrar('https://illumidesk', batch_window=0.05)
+    launch = make_launch()
+    launch['https://purl.imsglobal.org/spec/lti/claim/message_type'] = 'LtiDeepLinkingRequest'
+    registrar.register(launch)
+    assert registrar.pending == {}
+
+
+def test_launch_without_optional_claims_is_registered(posted):
+    registrar = illumidesk.AssignmentRegistrar('https://illumidesk', batch_window=0.05)
+    launch = make_launch()
+    del launch['https://purl.imsglobal.org/spec/lti/claim/resource_link']['description']
+    del launch['https://purl.imsglobal.org/spec/lti/claim/resource_link']['title']
+
+    async def run():
+        registrar.register(launch)
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert len(posted) == 1
+    assert posted[0][1]['description'] == ''
+    assert posted[0][1]['name'] == ''
+
+
+def test_register_assignment_never_raises(posted, monkeypatch):
+    monkeypatch.setattr(illumidesk, '_registrars', {})
+    launch = make_launch()
+    del launch['https://purl.imsglobal.org/spec/lti/claim/resource_link']
+    illumidesk.register_assignment(launch, 'https://illumidesk')
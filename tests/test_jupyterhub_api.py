@@ -0,0 +1,190 @@
+import asyncio
+import json
+
+from types import SimpleNamespace
+
+from tornado.httpclient import HTTPClientError
+
+from auth.jupyterhub_api import HubState
+
+
+def response(data):
+    return SimpleNamespace(body=json.dumps(data).encode())
+
+
+class FakeJupyterHubAPI:
+    def __init__(self, users=(), groups=None, fail_listing=False, invalid=(), paginated=True):
+        self.users = set(users)
+        self.groups = {name: set(members) for name, members in (groups or {}).items()}
+        self.fail_listing = fail_listing
+        self.invalid = set(invalid)
+        self.paginated = paginated
+        self.calls = []
+
+    def page(self, items, offset, limit):
+        if not self.paginated:
+            return response(items)
+        end = offset + limit
+        next_page = {'offset': end, 'limit': limit} if end < len(items) else None
+        return response({
+            'items': items[offset:end],
+            '_pagination': {'offset': offset, 'limit': limit, 'total': len(items), 'next': next_page},
+        })
+
+    async def get_users(self, offset=0, limit=200):
+        self.calls.append(('get_users',))
+        if self.fail_listing:
+            raise HTTPClientError(503)
+        return self.page([{'name': name} for name in sorted(self.users)], offset, limit)
+
+    async def get_groups(self, offset=0, limit=200):
+        self.calls.append(('get_groups',))
+        items = [{'name': name, 'users': sorted(members)} for name, members in sorted(self.groups.items())]
+        return self.page(items, offset, limit)
+
+    async def get_group(self, group_name):
+        self.calls.append(('get_group', group_name))
+        return response({'name': group_name, 'users': sorted(self.groups[group_name])})
+
+    async def create_group(self, group_name):
+        self.calls.append(('create_group', group_name))
+        if group_name in self.groups:
+            raise HTTPClientError(409)
+        self.groups[group_name] = set()
+
+    async def create_users(self, *users):
+        self.calls.append(('create_users',) + users)
+        if self.invalid.intersection(users):
+            raise HTTPClientError(400)
+        self.users.update(users)
+
+    async def create_user(self, username):
+        self.calls.append(('create_user', username))
+        if username in self.invalid:
+            raise HTTPClientError(400)
+        if username in self.users:
+            raise HTTPClientError(409)
+        self.users.add(username)
+
+    async def add_group_members(self, group, *members):
+        self.calls.append(('add_group_members', group) + members)
+        if not self.users.issuperset(members):
+            raise HTTPClientError(404)
+        self.groups[group].update(members)
+
+
+async def provision(hub_state, group, *usernames):
+    await hub_state.ensure_group(group)
+    existing = await hub_state.ensure_users(*usernames)
+    await hub_state.ensure_group_members(group, *existing)
+
+
+def test_only_missing_users_and_members_are_sent():
+    api = FakeJupyterHubAPI(users={'alice', 'bob'}, groups={'nbgrader-course': {'alice'}})
+    hub_state = HubState(api)
+    asyncio.run(provision(hub_state, 'nbgrader-course', 'alice', 'bob', 'carol'))
+    assert api.calls == [
+        ('get_users',),
+        ('get_groups',),
+        ('create_users', 'carol'),
+        ('add_group_members', 'nbgrader-course', 'bob', 'carol'),
+    ]
+
+
+def test_repeat_sync_makes_no_calls():
+    api = FakeJupyterHubAPI()
+    hub_state = HubState(api)
+
+    async def run():
+        await provision(hub_state, 'formgrade-course', 'alice', 'bob')
+        api.calls.clear()
+        await provision(hub_state, 'formgrade-course', 'alice', 'bob')
+
+    asyncio.run(run())
+    assert api.calls == []
+    assert api.groups == {'formgrade-course': {'alice', 'bob'}}
+
+
+def test_invalid_username_does_not_block_the_others():
+    api = FakeJupyterHubAPI(groups={'nbgrader-course': set()}, invalid={'bad name'})
+    hub_state = HubState(api)
+    asyncio.run(provision(hub_state, 'nbgrader-course', 'alice', 'bad name', 'bob'))
+    assert api.users == {'alice', 'bob'}
+    assert api.groups['nbgrader-course'] == {'alice', 'bob'}
+    assert hub_state.users == {'alice', 'bob'}
+
+
+def test_failed_listing_falls_back_to_group_lookup():
+    api = FakeJupyterHubAPI(users={'alice'}, groups={'nbgrader-course': {'alice'}}, fail_listing=True)
+    hub_state = HubState(api)
+    asyncio.run(provision(hub_state, 'nbgrader-course', 'alice', 'bob'))
+    assert ('get_group', 'nbgrader-course') in api.calls
+    assert api.calls[-1] == ('add_group_members', 'nbgrader-course', 'bob')
+    assert api.calls.count(('get_users',)) == 1
+
+
+def test_reconcile_replaces_mirror_with_hub_state():
+    api = FakeJupyterHubAPI(users={'alice'}, groups={'nbgrader-course': {'alice'}})
+    hub_state = HubState(api)
+
+    async def run():
+        await hub_state.ensure_synced()
+        api.users.add('dave')
+        api.groups['nbgrader-course'].add('dave')
+        await hub_state.reconcile()
+
+    asyncio.run(run())
+    assert hub_state.users == {'alice', 'dave'}
+    assert hub_state.groups == {'nbgrader-course': {'alice', 'dave'}}
+
+
+def test_sync_follows_pagination():
+    users = {f'user{i}' for i in range(450)}
+    api = FakeJupyterHubAPI(users=users, groups={f'group{i}': {'user0'} for i in range(3)})
+    hub_state = HubState(api, page_size=200)
+    asyncio.run(hub_state.sync())
+    assert hub_state.users == users
+    assert len(hub_state.groups) == 3
+    assert api.calls.count(('get_users',)) == 3
+
+
+def test_sync_accepts_unpaginated_listing():
+    api = FakeJupyterHubAPI(users={'alice', 'bob'}, groups={'nbgrader-course': {'alice'}}, paginated=False)
+    hub_state = HubState(api)
+    asyncio.run(hub_state.sync())
+    assert hub_state.users == {'alice', 'bob'}
+    assert hub_state.groups == {'nbgrader-course': {'alice'}}
+
+
+def test_failed_first_sync_is_retried_after_backoff():
+    api = FakeJupyterHubAPI(users={'alice'}, fail_listing=True)
+    hub_state = HubState(api)
+
+    async def run():
+        assert not await hub_state.ensure_synced()
+        # within the backoff window logins do not retry the listing
+        assert not await hub_state.ensure_synced()
+        assert api.calls.count(('get_users',)) == 1
+        api.fail_listing = False
+        hub_state._retry_at = 0
+        return await hub_state.ensure_synced()
+
+    assert asyncio.run(run())
+    assert hub_state.users == {'alice'}
+
+
+def test_stale_member_does_not_block_the_others():
+    api = FakeJupyterHubAPI(users={'alice', 'bob'}, groups={'nbgrader-course': set()})
+    hub_state = HubState(api)
+
+    async def run():
+        await hub_state.ensure_synced()
+        # deleted on the hub after the mirror was filled
+        api.users.discard('bob')
+        await hub_state.ensure_group_members('nbgrader-course', 'alice', 'bob')
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert api.groups['nbgrader-course'] == {'alice'}
+    assert hub_state.groups['nbgrader-course'] == {'alice'}
+    assert 'bob' not in hub_state.users
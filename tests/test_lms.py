@@ -0,0 +1,72 @@
+import asyncio
+import time
+
+import pytest
+
+from auth import lms
+
+
+@pytest.fixture
+def token_exchange(monkeypatch):
+    calls = []
+
+    async def fake_get_lms_access_token(iss, token_endpoint, private_key, client_id, scope=None):
+        calls.append((iss, token_endpoint, client_id, scope))
+        await asyncio.sleep(0.01)
+        return {'access_token': f'token-{len(calls)}', 'token_type': 'Bearer', 'expires_in': 3600}
+
+    monkeypatch.setattr(lms, 'get_lms_access_token', fake_get_lms_access_token)
+    monkeypatch.setattr(lms, '_access_tokens', {})
+    monkeypatch.setattr(lms, '_access_token_locks', {})
+    return calls
+
+
+def get_token(**kwargs):
+    return lms.get_cached_lms_access_token('https://hub', 'https://lms/token', 'key', 'client', **kwargs)
+
+
+def test_cached_token_is_reused(token_exchange):
+    async def run():
+        first = await get_token()
+        second = await get_token()
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == second
+    assert len(token_exchange) == 1
+
+
+def test_expired_token_is_refreshed(token_exchange):
+    async def run():
+        first = await get_token()
+        for cached in lms._access_tokens.values():
+            cached['expires_at'] = time.time() + 30
+        second = await get_token()
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first['access_token'] == 'token-1'
+    assert second['access_token'] == 'token-2'
+
+
+def test_min_lifetime_refreshes_half_used_token(token_exchange):
+    async def run():
+        await get_token()
+        for cached in lms._access_tokens.values():
+            cached['expires_at'] = time.time() + 1000
+        reused = await get_token()
+        fresh = await get_token(min_lifetime=0.5)
+        return reused, fresh
+
+    reused, fresh = asyncio.run(run())
+    assert reused['access_token'] == 'token-1'
+    assert fresh['access_token'] == 'token-2'
+
+
+def test_concurrent_requests_share_one_exchange(token_exchange):
+    async def run():
+        return await asyncio.gather(*[get_token() for _ in range(5)])
+
+    tokens = asyncio.run(run())
+    assert len(token_exchange) == 1
+    assert all(token == tokens[0] for token in tokens)